@@ -2,17 +2,21 @@ import os
 import sys
 import subprocess
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
-import gradio as gr
-from fastapi.responses import JSONResponse
 from urllib.parse import urlparse
 import re
-import requests
 import threading
 import json
 import shutil
 import time
+import hashlib
+from functools import lru_cache
+import bisect
+from collections import OrderedDict
+import itertools
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
 # ─── Translations ───────────────────────────────────────────────
 TRANSLATIONS = {
@@ -31,6 +35,8 @@ TRANSLATIONS = {
         "clear": "Clear",
         "rebuild": "Rebuild Index",
         "index_rebuilt": "Index rebuilt.",
+        "index_building": "Building index… ({secs}s)",
+        "index_busy": "An index build is already running.",
         "sources_label": "Sources:",
         "ollama_section": "Ollama Setup",
         "start_server": "Start Ollama Server",
@@ -60,6 +66,8 @@ TRANSLATIONS = {
         "clear": "Leeren",
         "rebuild": "Index neu aufbauen",
         "index_rebuilt": "Index neu aufgebaut.",
+        "index_building": "Index wird aufgebaut… ({secs}s)",
+        "index_busy": "Ein Indexaufbau läuft bereits.",
         "sources_label": "Quellen:",
         "ollama_section": "Ollama Einrichtung",
         "start_server": "Ollama-Server starten",
@@ -76,6 +84,12 @@ TRANSLATIONS = {
     },
 }
 
+@lru_cache(maxsize=4)
+def _t(lang: str) -> dict:
+    """Translation table for `lang`, falling back to English."""
+    return TRANSLATIONS.get(lang, TRANSLATIONS["en"])
+
+
 # Defaults
 DEFAULT_MODEL = "phi4-mini"
 
@@ -92,8 +106,19 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 if BASE_DIR not in sys.path:
     sys.path.insert(0, BASE_DIR)
 
-# Import from query.py
-import query as rag
+# query.py (embedding model + Chroma) and gradio are heavy; they are imported
+# inside the functions that need them so importing app.py for its helpers is cheap.
+import semantic_cache
+
+
+# Leading markdown heading markers ("## Title" -> "Title")
+_HEADING_RE = re.compile(r"^\s*#+\s*")
+
+
+@lru_cache(maxsize=4096)
+def _netloc(url: str) -> str:
+    # Sources come from a small set of doc pages, so repeat URLs are the norm
+    return urlparse(url).netloc
 
 
 def format_sources(items: List[dict], lang: str = "en") -> str:
@@ -104,30 +129,35 @@ def format_sources(items: List[dict], lang: str = "en") -> str:
     1. [Title](https://example.com) — example.com
     2. [Another](https://example.org) — example.org
     """
-    lines = []
+    # Preallocated: one line per item, filled by index
+    lines = [""] * len(items)
     def _shorten(text: str, max_len: int = 80) -> str:
         text = text.strip()
         if len(text) <= max_len:
             return text
         short = text[: max_len - 1]
         # Avoid cutting mid-word
-        short = short.rsplit(" ", 1)[0].rstrip(",.;:—-_")
+        cut = short.rfind(" ")
+        if cut != -1:
+            short = short[:cut]
+        short = short.rstrip(",.;:—-_")
         return short + "…"
 
     def _clean_title(raw: str) -> str:
         # Remove leading markdown heading markers and extra spaces
-        t = re.sub(r"^\s*#+\s*", "", raw or "").strip()
+        t = _HEADING_RE.sub("", raw or "").strip()
         return t
 
     for i, it in enumerate(items, 1):
-        raw_title = (it.get("title") or "# Abschnitt").strip()
+        # Items come from rag.retrieve, which guarantees every key as str
+        raw_title = (it["title"] or "# Abschnitt").strip()
         title = _clean_title(raw_title)
         if not title:
             title = "Abschnitt"
         title = _shorten(title)
-        url = (it.get("url") or "").strip()
-        path = (it.get("path") or "").strip()
-        content = (it.get("content") or "").strip()
+        url = it["url"].strip()
+        path = it["path"].strip()
+        content = it["content"].strip()
 
         # If title is still uninformative, fallback to a snippet of the content
         if title in {"#", "##", "###", "####", "#####", "######"} or len(title) <= 1:
@@ -136,156 +166,340 @@ def format_sources(items: List[dict], lang: str = "en") -> str:
 
         if url:
             # Add domain next to link for clarity
-            domain = urlparse(url).netloc or ""
+            domain = _netloc(url) or ""
             suffix = f" — {domain}" if domain else ""
-            lines.append(f"1. [{title}]({url}){suffix}")
+            lines[i - 1] = f"{i}. [{title}]({url}){suffix}"
         elif path:
             # Local file path fallback: do not show the filename, only the title
-            lines.append(f"1. {title}")
+            lines[i - 1] = f"{i}. {title}"
         else:
-            lines.append(f"1. {title}")
+            lines[i - 1] = f"{i}. {title}"
 
-    # Convert temporary "1." items to a proper ordered list
-    numbered = []
-    for idx, line in enumerate(lines, 1):
-        numbered.append(line.replace("1.", f"{idx}.", 1))
+    t = _t(lang)
+    return f"{t['sources_label']}\n" + "\n".join(lines)
 
-    t = TRANSLATIONS.get(lang, TRANSLATIONS["en"])
-    return f"{t['sources_label']}\n" + "\n".join(numbered)
 
+# Static prompt parts, built once; build_prompt only joins the dynamic pieces
+_PROMPT_HEAD = (
+    "You are a helpful assistant. Answer the user question using the provided context snippets.\n"
+    "If the answer cannot be found in the context, say you are not sure.\n\n"
+    "Context:\n"
+)
+_PROMPT_QUESTION = "\n\nQuestion: "
+_PROMPT_TAIL = "\nAnswer in the same language as the question."
+_CTX_FMT = "{title}:\n{content}".format_map
 
-def build_prompt(question: str, contexts: List[dict]) -> str:
-    # Trim each chunk to keep prompt compact for faster LLM inference
-    trimmed_chunks = []
-    total_chars = 0
-    MAX_TOTAL = 2800  # total context cap
+
+def dedupe_contexts(contexts: List[dict]) -> List[dict]:
+    """Drop chunks whose content repeats an earlier (higher-ranked) one, keeping order."""
+    seen = set()
+    uniq = []
     for c in contexts:
-        title = str(c.get('title', '')).strip()
-        content = str(c.get('content', '')).strip()
-        # sanitize title and cap lengths
-        title = re.sub(r"^\s*#+\s*", "", title)[:80]
-        if len(content) > 900:
-            content = content[:900].rsplit(" ", 1)[0] + "…"
-        block = f"{title}:\n{content}" if title else content
-        if total_chars + len(block) > MAX_TOTAL:
-            # if adding whole block exceeds cap, add partially if useful
-            remaining = max(0, MAX_TOTAL - total_chars)
-            if remaining > 200:
-                block = block[:remaining].rsplit(" ", 1)[0] + "…"
-                trimmed_chunks.append(block)
-            break
-        trimmed_chunks.append(block)
-        total_chars += len(block)
+        key = c["content"].strip()
+        if key in seen:
+            continue
+        seen.add(key)
+        uniq.append(c)
+    return uniq
+
+
+# Per-chunk and total context caps that keep the prompt compact for faster LLM inference
+MAX_CHUNK_CHARS = 900
+MAX_CONTEXT_CHARS = 2800
+
+
+def _format_block(c: dict) -> str:
+    """Render one context chunk as 'Title:\ncontent', sanitizing the title and capping the content."""
+    # rag.retrieve guarantees both keys are present as str
+    title = _HEADING_RE.sub("", c['title'].strip())[:80]
+    content = c['content'].strip()
+    if len(content) > MAX_CHUNK_CHARS:
+        content = content[:MAX_CHUNK_CHARS].rsplit(" ", 1)[0] + "…"
+    return _CTX_FMT({"title": title, "content": content}) if title else content
+
+
+def build_prompt(question: str, contexts: List[dict]) -> str:
+    blocks = [_format_block(c) for c in contexts]
+    # Keep the longest prefix of whole blocks within the cap (found by bisection
+    # over the running sizes), then add the next block partially if useful
+    sizes = list(itertools.accumulate(len(b) for b in blocks))
+    cut = bisect.bisect_right(sizes, MAX_CONTEXT_CHARS)
+    trimmed_chunks = blocks[:cut]
+    if cut < len(blocks):
+        remaining = MAX_CONTEXT_CHARS - (sizes[cut - 1] if cut else 0)
+        if remaining > 200:
+            trimmed_chunks.append(blocks[cut][:remaining].rsplit(" ", 1)[0] + "…")
 
     ctx_text = "\n\n".join(trimmed_chunks)
-    prompt = (
-        "You are a helpful assistant. Answer the user question using the provided context snippets.\n"
-        "If the answer cannot be found in the context, say you are not sure.\n\n"
-        f"Context:\n{ctx_text}\n\n"
-        f"Question: {question}\nAnswer in the same language as the question."
-    )
-    return prompt
+    return "".join((_PROMPT_HEAD, ctx_text, _PROMPT_QUESTION, question, _PROMPT_TAIL))
 
 
-def ask_ollama(prompt: str, model: str = DEFAULT_MODEL) -> str:
-    """Call Ollama via HTTP API with keep-alive and conservative generation options."""
-    url = "http://localhost:11434/api/generate"
-    payload = {
-        "model": model,
-        "prompt": prompt,
-        "stream": False,
-        "options": {
-            "keep_alive": "10m",
-            "num_predict": 256,
-            "num_ctx": 2048,
-            "temperature": 0.2,
-        },
-    }
-    try:
-        resp = requests.post(url, json=payload, timeout=120)
-        if resp.status_code != 200:
-            return f"(Ollama HTTP {resp.status_code}) {resp.text[:200]}\n\nShowing retrieved context instead."
-        data = resp.json()
-        return data.get("response", "")
-    except requests.exceptions.ConnectionError:
-        return "(Ollama server not running) Showing retrieved context instead."
-    except requests.exceptions.Timeout:
-        return "(Ollama timed out) Showing retrieved context instead."
-    except Exception as e:
-        return f"(Ollama error) {e}\n\nShowing retrieved context instead."
+# Shared HTTP session so every Ollama call reuses pooled keep-alive connections
+# to the resident daemon instead of opening a new socket per request. Clients are
+# built on first use: index worker processes re-import this module and need none.
+@lru_cache(maxsize=1)
+def _ollama_session():
+    import requests
+    return requests.Session()
 
-def _warm_up_model_async(model: str):
-    """Fire-and-forget small generate call to preload model into memory."""
+
+def _ollama_async_client():
+    """Async counterpart for the UI's streaming path; its pool belongs to the running loop."""
+    import httpx
+    return _loop_primitive("ollama_client", lambda: httpx.AsyncClient(
+        base_url="http://localhost:11434",
+        limits=httpx.Limits(max_keepalive_connections=8, max_connections=16),
+        timeout=120,
+    ))
+
+
+# Cap simultaneous generations: on single-GPU/CPU boxes concurrent Ollama calls
+# only contend with each other and hurt everyone's latency
+OLLAMA_MAX_CONCURRENCY = max(1, int(os.environ.get("OLLAMA_MAX_CONCURRENCY", "1")))
+
+# Asyncio locks/semaphores (and async clients) belong to one event loop (and before Python 3.10 grab
+# a loop when constructed), so they are created on first use inside the running
+# loop instead of at import; a different loop gets fresh ones.
+_LOOP_PRIMITIVES: dict = {}  # name -> (loop, primitive)
+
+
+def _loop_primitive(name: str, factory):
+    loop = asyncio.get_running_loop()
+    entry = _LOOP_PRIMITIVES.get(name)
+    if entry is None or entry[0] is not loop:
+        entry = (loop, factory())
+        _LOOP_PRIMITIVES[name] = entry
+    return entry[1]
+
+
+def _llm_semaphore() -> asyncio.Semaphore:
+    return _loop_primitive("llm", lambda: asyncio.Semaphore(OLLAMA_MAX_CONCURRENCY))
+
+
+# ─── LLM Response Cache ────────────────────────────────────────
+# Process-wide cache of completed generations keyed by (prompt digest, model),
+# so repeated questions skip the Ollama roundtrip entirely.
+LLM_CACHE_MAX = 512
+_LLM_CACHE: dict = {}
+_LLM_CACHE_LOCK = threading.Lock()
+
+
+def _llm_cache_key(prompt: str, model: str) -> tuple:
+    return (hashlib.blake2b(prompt.encode("utf-8"), digest_size=16).digest(), model)
+
+
+def _llm_cache_get(prompt: str, model: str):
+    with _LLM_CACHE_LOCK:
+        return _LLM_CACHE.get(_llm_cache_key(prompt, model))
+
+
+def _llm_cache_put(prompt: str, model: str, answer: str):
+    if not answer:
+        return
+    with _LLM_CACHE_LOCK:
+        # Evict oldest entries first (dicts preserve insertion order)
+        while len(_LLM_CACHE) >= LLM_CACHE_MAX:
+            _LLM_CACHE.pop(next(iter(_LLM_CACHE)))
+        _LLM_CACHE[_llm_cache_key(prompt, model)] = answer
+
+
+# Upper bound for a prompt sent to Ollama (~3k tokens at ~4 chars/token). Longer
+# prompts cannot fit num_ctx and tend to run into the 120s timeout instead.
+MAX_PROMPT_CHARS = 12000
+PROMPT_TOO_LONG_MSG = "(Ollama skipped: question too long) Showing retrieved context instead."
+
+
+def build_prompt_checked(question: str, contexts: List[dict]) -> Optional[str]:
+    """build_prompt, dropping lowest-ranked contexts until under MAX_PROMPT_CHARS.
+
+    Returns None when even the bare question does not fit, so callers can fail fast.
+    """
+    prompt = build_prompt(question, contexts)
+    dropped = 0
+    while len(prompt) > MAX_PROMPT_CHARS and contexts:
+        contexts = contexts[:-1]
+        dropped += 1
+        prompt = build_prompt(question, contexts)
+    if dropped:
+        print(f"⚠️ Prompt exceeded {MAX_PROMPT_CHARS} chars; dropped {dropped} lowest-ranked context(s).")
+    if len(prompt) > MAX_PROMPT_CHARS:
+        return None
+    return prompt
+
+
+def _warm_up_retrieval_async():
+    """Fire-and-forget dummy retrieval so the encoder and Chroma collection are loaded before the first query."""
     def _run():
         try:
-            _ = ask_ollama("Warm up.", model=model)
+            import query as rag
+            rag.retrieve("warmup", top_k=1)
         except Exception:
             pass
     threading.Thread(target=_run, daemon=True).start()
 
 
-def ask_ollama_stream(prompt: str, model: str = DEFAULT_MODEL):
-    """Stream tokens from Ollama HTTP API as they arrive."""
-    url = "http://localhost:11434/api/generate"
+_WARM_PAYLOAD = {"prompt": "", "keep_alive": "10m", "options": {"num_predict": 1}}
+# Skip re-warming a model loaded this recently (it stays resident for 10 minutes)
+WARM_TTL = 300.0
+_WARMED: dict = {}  # model -> monotonic time of the last successful warm-up
+_WARM_TASKS: set = set()  # strong refs so pending tasks are not garbage-collected
+
+
+def ask_ollama_warm(model: str = DEFAULT_MODEL) -> bool:
+    """Load a model into memory without generating (empty prompt), keeping it resident for 10 minutes."""
+    try:
+        resp = _ollama_session().post("http://localhost:11434/api/generate", json={"model": model, **_WARM_PAYLOAD}, timeout=120)
+        return resp.status_code == 200
+    except Exception:
+        return False
+
+
+async def ask_ollama_warm_async(model: str = DEFAULT_MODEL) -> bool:
+    """Async ask_ollama_warm on the shared pooled client."""
+    try:
+        resp = await _ollama_async_client().post("/api/generate", json={"model": model, **_WARM_PAYLOAD})
+        return resp.status_code == 200
+    except Exception:
+        return False
+
+
+def _recently_warmed(model: str) -> bool:
+    ts = _WARMED.get(model)
+    return ts is not None and time.monotonic() - ts < WARM_TTL
+
+
+async def _warm_model(model: str):
+    # One warm-up in flight at a time; repeated requests for a model collapse
+    async with _loop_primitive("warm", asyncio.Lock):
+        if _recently_warmed(model):
+            return
+        if await ask_ollama_warm_async(model):
+            _WARMED[model] = time.monotonic()
+
+
+def _warm_up_model_async(model: str):
+    """Fire-and-forget load of the model weights into memory.
+
+    Runs as a task on the current event loop (UI handlers); before the loop
+    exists, e.g. while the UI is being built, it falls back to a thread.
+    """
+    if _recently_warmed(model):
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        def _run():
+            if ask_ollama_warm(model):
+                _WARMED[model] = time.monotonic()
+        threading.Thread(target=_run, daemon=True).start()
+        return
+    task = loop.create_task(_warm_model(model))
+    _WARM_TASKS.add(task)
+    task.add_done_callback(_WARM_TASKS.discard)
+
+
+async def ask_ollama_stream_async(prompt: str, model: str = DEFAULT_MODEL, status: Optional[dict] = None):
+    """Stream tokens from the Ollama HTTP API without blocking the event loop.
+
+    Pass a `status` dict to learn whether the answer is complete: its "complete"
+    key is set to True only when Ollama reported `done` without any error.
+    """
+    import httpx
+    if status is not None:
+        status["complete"] = False
+    cached = _llm_cache_get(prompt, model)
+    if cached is not None:
+        if status is not None:
+            status["complete"] = True
+        yield cached
+        return
     payload = {
         "model": model,
         "prompt": prompt,
         "stream": True,
+        "keep_alive": "10m",
         "options": {
-            "keep_alive": "10m",
             "num_predict": 256,
             "num_ctx": 2048,
             "temperature": 0.2,
         },
     }
     try:
-        with requests.post(url, json=payload, stream=True, timeout=120) as resp:
+        async with _llm_semaphore(), _ollama_async_client().stream("POST", "/api/generate", json=payload) as resp:
             if resp.status_code != 200:
                 yield f"(Ollama HTTP {resp.status_code}) "
                 return
-            for line in resp.iter_lines(decode_unicode=True):
+            parts = []
+            async for line in resp.aiter_lines():
                 if not line:
                     continue
                 try:
                     data = json.loads(line)
                 except Exception:
                     continue
-                # Each chunk may have a 'response' token and a 'done' flag
+                if data.get("error"):
+                    yield f"(Ollama error) {data['error']}"
+                    return
                 token = data.get("response")
                 if token:
+                    parts.append(token)
                     yield token
                 if data.get("done"):
+                    _llm_cache_put(prompt, model, "".join(parts))
+                    if status is not None:
+                        status["complete"] = True
                     break
-    except requests.exceptions.ConnectionError:
+    except httpx.ConnectError:
         yield "(Ollama server not running)"
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         yield "(Ollama timed out)"
     except Exception as e:
         yield f"(Ollama error) {e}"
 
 
+# Minimum seconds between streamed chat updates sent to the browser
+STREAM_UPDATE_INTERVAL = 1 / 30
+
+
 # ─── Ollama Status Helpers ─────────────────────────────────────
+@lru_cache(maxsize=1)
 def _ollama_installed() -> bool:
+    # The binary does not appear/disappear during the lifetime of the app
     return shutil.which("ollama") is not None
 
 
-def _ollama_server_up(timeout: float = 2.0) -> bool:
-    try:
-        r = requests.get("http://localhost:11434/api/tags", timeout=timeout)
-        return r.status_code == 200
-    except Exception:
-        return False
+# One /api/tags request answers both "is the server up" and "which models";
+# the result is reused for a few seconds across UI callbacks.
+_PROBE_TTL = 5.0
+_PROBE_CACHE = {"ts": float("-inf"), "up": False, "models": []}
+_PROBE_LOCK = threading.Lock()
+
+
+def _ollama_probe(force: bool = False, timeout: float = 2.0) -> Tuple[bool, list]:
+    """Return (server_up, installed_models), cached for _PROBE_TTL seconds."""
+    with _PROBE_LOCK:
+        now = time.monotonic()
+        if not force and now - _PROBE_CACHE["ts"] < _PROBE_TTL:
+            return _PROBE_CACHE["up"], list(_PROBE_CACHE["models"])
+        up, models = False, []
+        try:
+            r = _ollama_session().get("http://localhost:11434/api/tags", timeout=timeout)
+            if r.status_code == 200:
+                up = True
+                data = r.json() or {}
+                models = [m.get("name") for m in data.get("models", []) if m.get("name")]
+        except Exception:
+            pass
+        _PROBE_CACHE.update(ts=time.monotonic(), up=up, models=models)
+        return up, list(models)
+
+
+def _ollama_server_up() -> bool:
+    return _ollama_probe()[0]
 
 
 def _ollama_list_models() -> list:
-    try:
-        r = requests.get("http://localhost:11434/api/tags", timeout=5)
-        if r.status_code != 200:
-            return []
-        data = r.json() or {}
-        return [m.get("name") for m in data.get("models", []) if m.get("name")]
-    except Exception:
-        return []
+    return _ollama_probe()[1]
 
 
 def _ollama_pull_model(model: str):
@@ -293,7 +507,7 @@ def _ollama_pull_model(model: str):
     url = "http://localhost:11434/api/pull"
     payload = {"name": model, "stream": True}
     try:
-        with requests.post(url, json=payload, stream=True, timeout=300) as resp:
+        with _ollama_session().post(url, json=payload, stream=True, timeout=300) as resp:
             if resp.status_code != 200:
                 # Provide a clearer message when model tag is invalid/non-existent
                 text = resp.text or ""
@@ -302,7 +516,8 @@ def _ollama_pull_model(model: str):
                 else:
                     yield f"HTTP {resp.status_code}: {text[:200]}"
                 return
-            for line in resp.iter_lines(decode_unicode=True):
+            # Raw byte lines straight into json.loads (no per-line str decode)
+            for line in resp.iter_lines():
                 if not line:
                     continue
                 try:
@@ -320,37 +535,78 @@ def _ollama_pull_model(model: str):
 
 
 def extractive_answer(question: str, contexts: List[dict], max_chars: int = 900) -> str:
-    # Simple heuristic: concatenate the most relevant chunks and trim
-    text = "\n\n".join([c.get("content", "") for c in contexts])
-    text = text.strip()
+    # Simple heuristic: concatenate the most relevant chunks and trim. Stop
+    # collecting once the answer is known to overflow, the rest is cut anyway.
+    parts, n = [], -2
+    for c in contexts:
+        content = c["content"]
+        if not parts:
+            # Leading blanks would be stripped from the joined text as well
+            content = content.lstrip()
+            if not content:
+                continue
+        parts.append(content)
+        # End of the last non-blank character is what survives strip()
+        end = len(content.rstrip())
+        if end and n + 2 + end > max_chars:
+            break
+        n += 2 + len(content)
+    text = "\n\n".join(parts).strip()
     if len(text) > max_chars:
-        text = text[:max_chars].rsplit(" ", 1)[0] + "…"
+        # Cut at the last space before the limit without copying/splitting the prefix
+        cut = text.rfind(" ", 0, max_chars)
+        text = text[:cut if cut > 0 else max_chars] + "…"
     return text
 
 
-def chat_fn(message: str, history: List[Tuple[str, str]], use_ollama: bool, ollama_model: str, k: int):
-    # Ensure index is ready
-    if not rag.META_FILE.exists() or not rag.INDEX_FILE.exists():
-        rag.build_index()
+# ─── Retrieval Cache ───────────────────────────────────────────
+# Exact-repeat questions (e.g. re-asked after toggling Ollama or switching model)
+# reuse the retrieved chunks instead of searching the index again.
+RETRIEVE_CACHE_MAX = 512
+_RETRIEVE_CACHE: "OrderedDict[tuple, tuple]" = OrderedDict()
+_RETRIEVE_CACHE_LOCK = threading.Lock()
+
 
-    # Retrieve
-    results = rag.retrieve(message, top_k=max(1, int(k)))
+def _retrieve_cached(message: str, k: int, query_vec=None) -> List[dict]:
+    """rag.retrieve with an LRU keyed by (normalized message, k)."""
+    import query as rag
+    key = (message.strip().lower(), k)
+    with _RETRIEVE_CACHE_LOCK:
+        hit = _RETRIEVE_CACHE.get(key)
+        if hit is not None:
+            _RETRIEVE_CACHE.move_to_end(key)
+            return list(hit)
+    results = tuple(rag.retrieve(message, top_k=k, query_vec=query_vec))
+    with _RETRIEVE_CACHE_LOCK:
+        _RETRIEVE_CACHE[key] = results
+        while len(_RETRIEVE_CACHE) > RETRIEVE_CACHE_MAX:
+            _RETRIEVE_CACHE.popitem(last=False)
+    return list(results)
 
-    # Build an answer
-    if use_ollama:
-        prompt = build_prompt(message, results)
-        answer = ask_ollama(prompt, model=ollama_model.strip() or DEFAULT_MODEL)
-    else:
-        answer = extractive_answer(message, results)
 
-    # Append Sources section only (no numeric inline citations)
-    sources_md = format_sources(results) if results else ""
-    response = f"{answer}\n\n{sources_md if sources_md else ''}"
+def _retrieve_cache_clear():
+    with _RETRIEVE_CACHE_LOCK:
+        _RETRIEVE_CACHE.clear()
 
-    return response
+
+# Serializes index builds; rebuilds run on a single background worker
+_BUILD_LOCK = threading.Lock()
+_BUILD_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index-build")
+
+
+def _ensure_index():
+    """Build the index on first run if it is missing."""
+    import query as rag
+    with _BUILD_LOCK:
+        if not rag.index_ready():
+            rag.build_index()
 
 
 def build_ui():
+    import gradio as gr
+    from fastapi.responses import JSONResponse
+    import query as rag
+
     with gr.Blocks(title="Oxaion Docs RAG", theme=gr.themes.Soft()) as demo:
         # Language selector
         # Use (label, value) tuples to comply with Gradio's expected format
@@ -359,17 +615,17 @@ def build_ui():
 
         # Header based on language
         def _header_text(lang: str):
-            t = TRANSLATIONS.get(lang, TRANSLATIONS["en"])
+            t = _t(lang)
             return f"{t['app_title']}\n{t['app_desc']}"
 
         header_md = gr.Markdown(_header_text(lang_sel.value if hasattr(lang_sel, 'value') else "de"))
 
         with gr.Row():
-            t0 = TRANSLATIONS.get(lang_sel.value if hasattr(lang_sel, 'value') else 'de', TRANSLATIONS['en'])
+            t0 = _t(lang_sel.value if hasattr(lang_sel, 'value') else 'de')
             # Enable Ollama by default
             use_ollama = gr.Checkbox(value=True, label=t0["use_ollama"])
             # Initialize model list dynamically if server running
-            _init_models = _ollama_list_models() if _ollama_server_up() else []
+            _, _init_models = _ollama_probe()
             _init_choices = _init_models if _init_models else OLLAMA_COMMON_MODELS
             # Convert to (label, value) tuples for Dropdown
             _model_choice_pairs = [(m, m) for m in _init_choices]
@@ -411,10 +667,9 @@ def build_ui():
 
 
             def _format_status(lang, model_name):
-                t = TRANSLATIONS.get(lang, TRANSLATIONS['en'])
+                t = _t(lang)
                 installed = _ollama_installed()
-                server = _ollama_server_up()
-                models = _ollama_list_models() if server else []
+                server, models = _ollama_probe()
                 model_avail = str(model_name) in models if model_name else False
                 lines = [
                     t["status_installed"].format(val="✅" if installed else "❌"),
@@ -426,7 +681,7 @@ def build_ui():
 
             def _refresh_status(lang, model_name):
                 md, models = _format_status(lang, model_name)
-                t = TRANSLATIONS.get(lang, TRANSLATIONS['en'])
+                t = _t(lang)
                 # Update dropdown choices to installed models if any
                 if models:
                     dd = gr.update(choices=[(m, m) for m in models], value=(model_name if model_name in models else (models[0] if models else None)))
@@ -435,20 +690,26 @@ def build_ui():
                 instr = gr.update(value=t["pull_instr"].format(model=(model_name or "")))
                 return gr.update(value=md), gr.update(value=t["install_hint"]), dd, instr
 
-            def _start_server(lang, model_name):
+            async def _start_server(lang, model_name):
                 # Try to start server if installed but not running
-                if _ollama_installed() and not _ollama_server_up():
+                if _ollama_installed() and not (await asyncio.to_thread(_ollama_probe, True))[0]:
                     try:
                         subprocess.Popen(["ollama", "serve"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                        time.sleep(2.0)
                     except Exception:
                         pass
+                    # Poll for up to 3s without holding a worker; the forced probe
+                    # also replaces the cached "down" result before reporting status
+                    for _ in range(30):
+                        if (await asyncio.to_thread(_ollama_probe, True))[0]:
+                            break
+                        await asyncio.sleep(0.1)
                 # Warm up selected (or default) model after server starts
                 try:
                     _warm_up_model_async(str(model_name or DEFAULT_MODEL))
                 except Exception:
                     pass
-                return _refresh_status(lang, model_name)
+                # _refresh_status probes Ollama again once the probe cache is stale
+                return await asyncio.to_thread(_refresh_status, lang, model_name)
 
             # (Removed pull button and log; provide manual instruction instead)
 
@@ -468,7 +729,7 @@ def build_ui():
             start_btn.click(_start_server, inputs=[lang_sel, ollama_model], outputs=[status_md, hint_md, ollama_model, instruction_md])
             # Update instruction when main model changes
             def _on_model_change(lang, model_name):
-                t = TRANSLATIONS.get(lang, TRANSLATIONS['en'])
+                t = _t(lang)
                 return gr.update(value=t["pull_instr"].format(model=(model_name or "")))
             ollama_model.change(_on_model_change, inputs=[lang_sel, ollama_model], outputs=[instruction_md])
 
@@ -483,60 +744,91 @@ def build_ui():
         msg = gr.Textbox(placeholder=t0["placeholder"], autofocus=True)
         clear = gr.Button(t0["clear"])
 
-        def respond(message, history, use_llm, model_name, k_val, lang):
-            """Generator function to support streaming when using Ollama."""
+        # Opened here, before serving, so no handler pays for loading it
+        answer_cache = semantic_cache.get_cache()
+
+        # The textbox is cleared once per request; every later yield reuses this
+        # no-op update (it has no value for Gradio's postprocessing to pop)
+        _keep_box = gr.update()
+
+        async def respond(message, history, use_llm, model_name, k_val, lang):
+            """Async generator: retrieval runs in a worker thread while the UI renders."""
             history = history or []  # list of {role, content}
             k_val = int(k_val)
             model_name = str(model_name)
             lang = str(lang or 'en')
 
-            # Retrieval first
-            results = rag.retrieve(message, top_k=max(1, k_val))
+            # Embed/retrieve off the event loop and show the user bubble meanwhile
+            embedding = asyncio.create_task(asyncio.to_thread(rag.embed, message))
+            working_history = history + [
+                {"role": "user", "content": message},
+                {"role": "assistant", "content": ""},
+            ]
+            yield working_history, gr.update(value="")
+            q = await embedding
+
+            # Paraphrased repeats skip retrieval and generation entirely
+            cache_key = (lang, model_name, k_val, bool(use_llm))
+            cached = await asyncio.to_thread(answer_cache.lookup, cache_key, q)
+            if cached is not None:
+                answer, sources_md = cached
+                working_history[-1]["content"] = f"{answer}\n\n{sources_md}" if sources_md else answer
+                yield working_history, _keep_box
+                return
+
+            results = dedupe_contexts(await asyncio.to_thread(_retrieve_cached, message, max(1, k_val), q))
 
             # If not using LLM, return extractive answer immediately
             if not use_llm:
                 if not results:
-                    answer = "No relevant sections found in the indexed docs."
-                    new_history = history + [
-                        {"role": "user", "content": message},
-                        {"role": "assistant", "content": answer},
-                    ]
-                    return new_history, gr.update(value="")
+                    working_history[-1]["content"] = "No relevant sections found in the indexed docs."
+                    yield working_history, _keep_box
+                    return
                 answer = extractive_answer(message, results)
-                sources_md = format_sources(results, lang=lang) if results else ""
-                new_history = history + [
-                    {"role": "user", "content": message},
-                    {"role": "assistant", "content": f"{answer}\n\n{sources_md}"},
-                ]
-                return new_history, gr.update(value="")
-
-            # Using LLM: stream tokens
-            prompt = build_prompt(message, results)
+                working_history[-1]["content"] = answer
+                yield working_history, _keep_box
+                sources_md = format_sources(results, lang=lang)
+                working_history[-1]["content"] = f"{answer}\n\n{sources_md}"
+                yield working_history, _keep_box
+                await asyncio.to_thread(answer_cache.store, cache_key, q, answer, sources_md, question=message)
+                return
 
-            # Initialize displayed assistant message
+            # Using LLM: stream tokens (fail fast if the prompt cannot fit)
+            prompt = build_prompt_checked(message, results)
+            if prompt is None:
+                answer = f"{PROMPT_TOO_LONG_MSG}\n\n{extractive_answer(message, results)}"
+                sources_md = format_sources(results, lang=lang) if results else ""
+                working_history[-1]["content"] = f"{answer}\n\n{sources_md}" if sources_md else answer
+                yield working_history, _keep_box
+                return
             assistant_text = ""
-            working_history = history + [
-                {"role": "user", "content": message},
-                {"role": "assistant", "content": assistant_text},
-            ]
-
-            # Yield once to show the assistant bubble immediately
-            yield working_history, gr.update(value="")
-
-            for chunk in ask_ollama_stream(prompt, model=model_name):
+            last_yield = 0.0
+            # Only a finished, error-free generation may be cached; a cut-off or
+            # failed stream would otherwise be served for the whole cache TTL
+            stream_status = {}
+            async for chunk in ask_ollama_stream_async(prompt, model=model_name, status=stream_status):
                 if not chunk:
                     continue
                 assistant_text += chunk
+                # Coalesce updates to ~30 per second (or at line breaks); each
+                # yield re-serializes the chat, and nobody reads faster than that
+                now = time.monotonic()
+                if now - last_yield < STREAM_UPDATE_INTERVAL and "\n" not in chunk:
+                    continue
+                last_yield = now
                 # Update last assistant message content
                 working_history[-1]["content"] = assistant_text
                 # Stream incremental updates
-                yield working_history, gr.update(value="")
+                yield working_history, _keep_box
 
             # Append sources at the end
             sources_md = format_sources(results, lang=lang) if results else ""
+            answer = assistant_text
             assistant_text = f"{assistant_text}\n\n{sources_md}" if sources_md else assistant_text
             working_history[-1]["content"] = assistant_text
-            yield working_history, gr.update(value="")
+            yield working_history, _keep_box
+            if answer and stream_status.get("complete"):
+                await asyncio.to_thread(answer_cache.store, cache_key, q, answer, sources_md, question=message)
 
         _evt = msg.submit(
             respond,
@@ -585,9 +877,26 @@ def build_ui():
         rebuild = gr.Button(t0["rebuild"])
         out_info = gr.Markdown(visible=False)
         def _rebuild():
-            rag.build_index()
-            t = TRANSLATIONS.get(lang_sel.value if hasattr(lang_sel, 'value') else 'de', TRANSLATIONS['en'])
-            return gr.update(value=t["index_rebuilt"], visible=True)
+            """Generator: run build_index in the background and stream progress."""
+            t = _t(lang_sel.value if hasattr(lang_sel, 'value') else 'de')
+            # Refuse concurrent rebuilds instead of queueing a second one
+            if not _BUILD_LOCK.acquire(blocking=False):
+                yield gr.update(value=t["index_busy"], visible=True)
+                return
+            try:
+                started = time.monotonic()
+                future = _BUILD_EXECUTOR.submit(rag.build_index)
+                while not future.done():
+                    secs = int(time.monotonic() - started)
+                    yield gr.update(value=t["index_building"].format(secs=secs), visible=True)
+                    time.sleep(1.0)
+                future.result()
+                # Cached answers may cite chunks that changed or no longer exist
+                answer_cache.invalidate()
+                _retrieve_cache_clear()
+            finally:
+                _BUILD_LOCK.release()
+            yield gr.update(value=t["index_rebuilt"], visible=True)
         rebuild.click(fn=_rebuild, outputs=[out_info])
 
         # Warm up the default Ollama model in the background to reduce first-token latency
@@ -598,7 +907,7 @@ def build_ui():
 
         # Language change handler updates labels/placeholders/header
         def _apply_lang(lang, model_name):
-            t = TRANSLATIONS.get(lang, TRANSLATIONS['en'])
+            t = _t(lang)
             text, vis = _hint_text(lang, use_ollama.value if hasattr(use_ollama, 'value') else True)
             return (
                 gr.update(value=_header_text(lang)),
@@ -640,8 +949,21 @@ def build_ui():
 
 
 if __name__ == "__main__":
+    # Index builds may use worker processes; required for the frozen Windows .exe
+    import multiprocessing
+    multiprocessing.freeze_support()
+    import query as rag
+    rag.configure_cpu_threads()
     # Build index on first run if missing
-    if not rag.META_FILE.exists() or not rag.INDEX_FILE.exists():
-        rag.build_index()
+    _ensure_index()
+    # Pay embedding/collection cold-start now rather than on the first question
+    _warm_up_retrieval_async()
     ui = build_ui()
-    ui.launch(server_name="0.0.0.0", server_port=int(os.environ.get("PORT", 7860)), inbrowser=True)
+    # Bounded queue/thread pool: admission control instead of unbounded worker fan-out
+    ui.queue(default_concurrency_limit=2, max_size=32)
+    ui.launch(
+        server_name="0.0.0.0",
+        server_port=int(os.environ.get("PORT", 7860)),
+        inbrowser=True,
+        max_threads=8,
+    )
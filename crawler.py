@@ -1,10 +1,11 @@
 import sys
 import os
 import asyncio
-from collections import deque
 from urllib.parse import urldefrag, urljoin
 from pathlib import Path
 
+import xxhash
+
 # ─── Add local crawl4ai package to sys.path ─────────────────────
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CRAWL4AI_PKG_ROOT = os.path.join(BASE_DIR, "crawl4ai")
@@ -23,6 +24,10 @@ START_URL = "https://docs.oxaion.de/spaces/open/overview"
 ALLOWED_PREFIX = "https://docs.oxaion.de/spaces/open/"
 DOCS_DIR = Path("data/docs")
 DOCS_DIR.mkdir(parents=True, exist_ok=True)
+# Pages rendered in parallel; each one is a Chromium tab, so keep this modest
+CRAWL_CONCURRENCY = max(1, int(os.environ.get("CRAWL_CONCURRENCY", "8")))
+# "browser" (default, renders JavaScript) or "http" (much lighter, static pages only)
+CRAWL_MODE = os.environ.get("CRAWL_MODE", "browser").strip().lower()
 
 
 async def crawl_all():
@@ -30,8 +35,7 @@ async def crawl_all():
     Crawl Oxaion Docs and save each page as Markdown
     """
     print(f"[CRAWL] Starting at {START_URL}")
-    # Use text_mode to speed up rendering (disables images/remote fonts; may disable JS)
-    async with AsyncWebCrawler(config=BrowserConfig(text_mode=True, headless=True, verbose=False)) as crawler:
+    async with make_crawler() as crawler:
         # Relax page load condition and increase timeout to avoid navigation timeouts
         config = CrawlerRunConfig(
             markdown_generator=DefaultMarkdownGenerator(),
@@ -47,49 +51,116 @@ async def crawl_all():
                 "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36"
             ),
         )
-
-        # BFS crawl with queue/visited to go beyond one level
-        queue = deque([START_URL])
-        visited = set()
-
-        # Crawl without a page limit (may take a long time)
-        while queue:
-            url = queue.popleft()
-            # avoid re-processing
-            if url in visited:
-                continue
-            visited.add(url)
-
-            # Retry a few times on transient navigation issues/timeouts
-            result = None
-            for attempt in range(3):
+        # One long-lived browser tab per concurrency slot: with a session_id
+        # crawl4ai reuses the page instead of opening a fresh one per URL
+        slot_configs = [config.clone(session_id=f"crawl-slot-{i}") for i in range(CRAWL_CONCURRENCY)]
+
+        # BFS crawl with queue/seen to go beyond one level. One worker per slot
+        # pulls from the shared queue, so a slow page only holds up its own slot
+        queue: asyncio.Queue = asyncio.Queue()
+        queue.put_nowait(START_URL)
+        # Every URL ever enqueued, as 64-bit xxh3 digests (far smaller than the
+        # strings). Marking at enqueue time means each URL is queued only once,
+        # so nothing needs to be re-checked when it is popped.
+        seen = {url_key(START_URL)}
+
+        async def worker(slot_config):
+            while True:
+                url = await queue.get()
                 try:
-                    result = await crawler.arun(url, config=config)
-                    break
+                    result = await fetch_page(crawler, url, slot_config)
+                    if result:
+                        process_result(url, result, queue, seen)
                 except Exception as e:
-                    print(f"[ERROR] Fetch failed for {url} (attempt {attempt+1}/3): {e}")
-                    await asyncio.sleep(2 * (attempt + 1))
-            if not result:
-                continue
-
-            if result and result.success and result.markdown:
-                save_markdown(url, result.markdown.raw_markdown)
-
-            # extract and enqueue next links (resolve relative URLs against the current page)
-            next_links = extract_link_urls(getattr(result, "links", None)) if result else []
-            base_url = getattr(result, "redirected_url", None) or url
-            enqueued = 0
-            for href in next_links:
-                if not isinstance(href, str):
-                    continue
-                # resolve relative links and strip fragments
-                full_url = urljoin(base_url, href)
-                full_url, _ = urldefrag(full_url)
-                if full_url.startswith(ALLOWED_PREFIX) and full_url not in visited and full_url not in queue:
-                    queue.append(full_url)
-                    enqueued += 1
-            if enqueued:
-                print(f"[QUEUE] {url} → added {enqueued} links (queue size: {len(queue)})")
+                    print(f"[ERROR] Processing failed for {url}: {e}")
+                finally:
+                    queue.task_done()
+
+        # Crawl without a page limit (may take a long time); done once the queue
+        # is empty and no worker is still fetching (and possibly adding links)
+        workers = [asyncio.create_task(worker(slot_config)) for slot_config in slot_configs]
+        await queue.join()
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+        for slot_config in slot_configs:
+            await kill_session(crawler, slot_config.session_id)
+
+
+def process_result(url: str, result, queue: asyncio.Queue, seen: set):
+    """
+    Save a fetched page and enqueue its unseen in-scope links
+    """
+    if result.success and result.markdown:
+        save_markdown(url, result.markdown.raw_markdown)
+
+    # extract and enqueue next links (resolve relative URLs against the current page)
+    next_links = extract_link_urls(getattr(result, "links", None))
+    base_url = getattr(result, "redirected_url", None) or url
+    enqueued = 0
+    for href in next_links:
+        if not isinstance(href, str):
+            continue
+        # resolve relative links and strip fragments
+        full_url = urljoin(base_url, href)
+        full_url, _ = urldefrag(full_url)
+        if not full_url.startswith(ALLOWED_PREFIX):
+            continue
+        key = url_key(full_url)
+        if key not in seen:
+            seen.add(key)
+            queue.put_nowait(full_url)
+            enqueued += 1
+    if enqueued:
+        print(f"[QUEUE] {url} → added {enqueued} links (queue size: {queue.qsize()})")
+
+
+def make_crawler() -> AsyncWebCrawler:
+    """
+    Headless Chromium by default; CRAWL_MODE=http fetches plain HTML without a browser
+    """
+    if CRAWL_MODE == "http":
+        # The docs are server-rendered, so a plain HTTP fetch yields the same markdown
+        from crawl4ai.async_crawler_strategy import AsyncHTTPCrawlerStrategy
+        print("[CRAWL] HTTP mode (no browser)")
+        return AsyncWebCrawler(crawler_strategy=AsyncHTTPCrawlerStrategy())
+    # Use text_mode to speed up rendering (disables images/remote fonts; may disable JS)
+    return AsyncWebCrawler(config=BrowserConfig(text_mode=True, headless=True, verbose=False))
+
+
+async def fetch_page(crawler, url: str, config):
+    """
+    Fetch one page, retrying a few times on transient navigation issues/timeouts
+    """
+    for attempt in range(3):
+        try:
+            return await crawler.arun(url, config=config)
+        except Exception as e:
+            print(f"[ERROR] Fetch failed for {url} (attempt {attempt+1}/3): {e}")
+            # The tab may be stuck mid-navigation; retry on a fresh one
+            await kill_session(crawler, config.session_id)
+            await asyncio.sleep(2 * (attempt + 1))
+    return None
+
+
+async def kill_session(crawler, session_id):
+    """
+    Close the browser tab behind a crawl4ai session (no-op if it does not exist)
+    """
+    if not session_id:
+        return
+    try:
+        await crawler.crawler_strategy.kill_session(session_id)
+    except Exception:
+        pass
+
+
+def url_key(url: str) -> int:
+    """
+    Compact 64-bit key for the seen set
+    """
+    return xxhash.xxh3_64_intdigest(url)
 
 
 def safe_filename(url: str) -> str:
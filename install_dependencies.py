@@ -58,6 +58,7 @@ requirements = [
     "chardet",
     "chromadb",
     "requests",
+    "httpx",
 ]
 for pkg in requirements:
     run([pip_exec(), "install", pkg])
@@ -3,14 +3,19 @@ import os
 import pickle
 import numpy as np
 from pathlib import Path
-from sentence_transformers import SentenceTransformer
 import re
 import json
 import time
 import hashlib
+import multiprocessing
+import xxhash
 import chromadb
 from chromadb.config import Settings
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+from functools import lru_cache
 
 # ─── Add crawl4ai/src to sys.path ───────────────────────────────
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -20,7 +25,12 @@ if CRAWL4AI_SRC not in sys.path:
 
 # ─── Paths ─────────────────────────────────────────────────────
 DOCS_DIR = Path("data/docs")
+# Build marker kept for older checks of its existence; holds no chunk data
 META_FILE = Path("data/meta.pkl")
+META_SCHEMA_VERSION = 1
+# Bump whenever clean_text/chunk_markdown/_chunk_id change what a file turns into;
+# a manifest from another version re-chunks every file instead of trusting mtime/sha1
+PIPELINE_VERSION = 1
 # Maintain an INDEX_FILE path for compatibility with app.py checks,
 # but use a marker file inside the Chroma directory instead of a FAISS index
 CHROMA_DIR = Path("data/chroma")
@@ -29,11 +39,62 @@ MANIFEST_FILE = CHROMA_DIR / "manifest.json"
 
 # ─── Embedding Model ───────────────────────────────────────────
 # Multilingual model for better cross-lingual matching (EN queries ↔ DE docs)
-model = SentenceTransformer("sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+ST_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
 DEFAULT_EMBED_MODEL = os.environ.get("EMBED_MODEL", "nomic-embed-text")
+# Texts per /api/embed request; servers without that endpoint fall back to
+# parallel single-text /api/embeddings requests
+OLLAMA_EMBED_BATCH = 64
+_EMBED_BATCH_SUPPORTED = None  # unknown until the first call
+# Parallel /api/embeddings requests while indexing (legacy endpoint)
+OLLAMA_EMBED_CONCURRENCY = max(1, int(os.environ.get("OLLAMA_EMBED_CONCURRENCY", "16")))
+ST_BATCH_SIZE = 64       # CPU
+ST_BATCH_SIZE_GPU = 128  # CUDA/MPS have headroom for larger batches
+# Encoder device; empty lets sentence-transformers pick CUDA, then MPS, then CPU
+EMBED_DEVICE = os.environ.get("EMBED_DEVICE", "").strip() or None
+# Optional faster CPU inference for the fallback encoder, e.g. ST_BACKEND=onnx
+# (needs sentence-transformers>=3.2 and `pip install optimum[onnxruntime]`)
+ST_BACKEND = os.environ.get("ST_BACKEND", "").strip().lower()
 
 # Chroma settings
 COLLECTION_NAME = "oxaion-docs"
+# Changed files needed before chunking is spread over worker processes
+# (below this, process start-up costs more than it saves)
+PARALLEL_MIN_FILES = 32
+# Rows per Chroma add/delete call while indexing
+CHROMA_BATCH = 256
+# HNSW query breadth: higher finds better neighbours at some latency cost
+# (Chroma's default is 100). Leave empty to keep the collection's setting.
+CHROMA_SEARCH_EF = int(os.environ.get("CHROMA_SEARCH_EF", "0") or 0)
+
+def configure_cpu_threads():
+    """
+    Let CPU encoding use every core. Call once from a script entry point,
+    before the encoder is loaded; library imports leave thread settings alone.
+    """
+    n = int(os.environ.get("TORCH_NUM_THREADS", "0") or 0) or os.cpu_count() or 1
+    # Read by OpenMP/MKL when torch is first imported
+    os.environ.setdefault("OMP_NUM_THREADS", str(n))
+    os.environ.setdefault("MKL_NUM_THREADS", str(n))
+    try:
+        import torch
+        torch.set_num_threads(n)
+    except Exception:
+        pass
+
+@lru_cache(maxsize=1)
+def _get_model():
+    """Load the SentenceTransformer fallback once, on first use (not at import)."""
+    from sentence_transformers import SentenceTransformer
+    if ST_BACKEND and ST_BACKEND != "torch":
+        try:
+            return SentenceTransformer(ST_MODEL_NAME, device=EMBED_DEVICE, backend=ST_BACKEND)
+        except Exception as e:
+            print(f"⚠️ ST_BACKEND={ST_BACKEND} unavailable ({e}); using PyTorch.")
+    st = SentenceTransformer(ST_MODEL_NAME, device=EMBED_DEVICE)
+    # Half precision doubles CUDA throughput; cosine ranking is unaffected in practice
+    if st.device.type == "cuda":
+        st.half()
+    return st
 
 def _chroma_client():
     CHROMA_DIR.mkdir(parents=True, exist_ok=True)
@@ -41,29 +102,75 @@ def _chroma_client():
     settings = Settings(anonymized_telemetry=False)
     return chromadb.PersistentClient(path=str(CHROMA_DIR), settings=settings)
 
+# Keep-alive connections to the local Ollama server, enough for the parallel
+# embedding workers so none of them has to open a fresh socket
+_OLLAMA_SESSION = requests.Session()
+_OLLAMA_SESSION.mount(
+    "http://",
+    HTTPAdapter(pool_connections=4, pool_maxsize=max(16, OLLAMA_EMBED_CONCURRENCY)),
+)
+
+# _embed_texts asks before every embedding call; re-probe at most this often
+_PROBE_TTL = 30.0
+_PROBE_CACHE = {"ts": float("-inf"), "up": False}
+
 def _ollama_server_up(timeout: float = 2.0) -> bool:
+    now = time.monotonic()
+    if now - _PROBE_CACHE["ts"] < _PROBE_TTL:
+        return _PROBE_CACHE["up"]
     try:
-        r = requests.get("http://localhost:11434/api/tags", timeout=timeout)
-        return r.status_code == 200
+        r = _OLLAMA_SESSION.get("http://localhost:11434/api/tags", timeout=timeout)
+        up = r.status_code == 200
     except Exception:
-        return False
+        up = False
+    _PROBE_CACHE.update(ts=now, up=up)
+    return up
+
+def _ollama_embed_one(url: str, text: str, model_name: str) -> list:
+    resp = _OLLAMA_SESSION.post(url, json={"model": model_name, "prompt": text}, timeout=120)
+    if resp.status_code != 200:
+        raise RuntimeError(f"Ollama HTTP {resp.status_code}: {resp.text[:180]}")
+    data = resp.json() or {}
+    emb = data.get("embedding")
+    if not emb:
+        raise RuntimeError("No embedding returned")
+    return emb
+
+def _ollama_embed_batched(texts: list[str], model_name: str):
+    """Embed via /api/embed, OLLAMA_EMBED_BATCH texts per request. None if the server lacks it."""
+    global _EMBED_BATCH_SUPPORTED
+    vecs = []
+    for i in range(0, len(texts), OLLAMA_EMBED_BATCH):
+        payload = {"model": model_name, "input": texts[i:i + OLLAMA_EMBED_BATCH]}
+        resp = _OLLAMA_SESSION.post("http://localhost:11434/api/embed", json=payload, timeout=600)
+        if resp.status_code == 404:
+            # Older Ollama (< 0.3.4) has no /api/embed; a missing model 404s too,
+            # in which case only this call falls back
+            if "model" not in resp.text.lower():
+                _EMBED_BATCH_SUPPORTED = False
+            return None
+        if resp.status_code != 200:
+            raise RuntimeError(f"Ollama HTTP {resp.status_code}: {resp.text[:180]}")
+        embs = (resp.json() or {}).get("embeddings") or []
+        if len(embs) != len(payload["input"]):
+            raise RuntimeError("Ollama returned a wrong number of embeddings")
+        vecs.extend(embs)
+    return vecs
 
 def _ollama_embed(texts: list[str], model_name: str) -> np.ndarray:
+    if _EMBED_BATCH_SUPPORTED is not False:
+        vecs = _ollama_embed_batched(texts, model_name)
+        if vecs is not None:
+            return np.array(vecs, dtype="float32")
     url = "http://localhost:11434/api/embeddings"
-    vecs = []
-    for t in texts:
-        payload = {"model": model_name, "prompt": t}
-        try:
-            resp = requests.post(url, json=payload, timeout=120)
-            if resp.status_code != 200:
-                raise RuntimeError(f"Ollama HTTP {resp.status_code}: {resp.text[:180]}")
-            data = resp.json() or {}
-            emb = data.get("embedding")
-            if not emb:
-                raise RuntimeError("No embedding returned")
-            vecs.append(emb)
-        except Exception as e:
-            raise e
+    if len(texts) <= 1:
+        vecs = [_ollama_embed_one(url, t, model_name) for t in texts]
+    else:
+        # One text per request on this endpoint: overlap the round trips
+        # (map keeps input order; the first failure propagates)
+        workers = min(OLLAMA_EMBED_CONCURRENCY, len(texts))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            vecs = list(pool.map(lambda t: _ollama_embed_one(url, t, model_name), texts))
     arr = np.array(vecs, dtype="float32")
     return arr
 
@@ -72,74 +179,109 @@ def _embed_texts(texts: list[str]) -> np.ndarray:
     if _ollama_server_up():
         try:
             arr = _ollama_embed(texts, DEFAULT_EMBED_MODEL)
-            # normalize
-            norms = np.linalg.norm(arr, axis=1, keepdims=True)
+            # normalize in place: row norms via einsum, no second N×D array
+            norms = np.sqrt(np.einsum("ij,ij->i", arr, arr))
             norms[norms == 0] = 1.0
-            arr = arr / norms
+            arr /= norms[:, None]
             return arr
         except Exception:
             # Fallback below
             pass
-    # SentenceTransformers fallback
-    arr = model.encode(texts, convert_to_numpy=True).astype("float32")
-    norms = np.linalg.norm(arr, axis=1, keepdims=True)
-    norms[norms == 0] = 1.0
-    arr = arr / norms
-    return arr
-
-def _embed_query(text: str) -> list:
-    arr = _embed_texts([text])
-    return arr.tolist()
+    # SentenceTransformers fallback (explicit batch size: on CPU larger batches
+    # amortize per-call dispatch overhead better than the default of 32).
+    # No manual length sorting needed: encode() already orders inputs by length
+    # before batching and restores the original order, so padding stays minimal.
+    # normalize_embeddings folds the L2 normalization into encode() (zero vectors stay zero)
+    st = _get_model()
+    on_cpu = getattr(getattr(st, "device", None), "type", "cpu") == "cpu"
+    batch_size = ST_BATCH_SIZE if on_cpu else ST_BATCH_SIZE_GPU
+    arr = st.encode(
+        texts,
+        batch_size=batch_size,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=False,  # no tqdm bar per call; build_index logs its own progress
+    )
+    # fp16 output on CUDA is widened here; Chroma and the caches expect float32
+    return arr.astype("float32", copy=False)
+
+def _embed_query(text: str) -> np.ndarray:
+    return _embed_texts([text])
+
+def embed(text: str) -> np.ndarray:
+    """Return the normalized embedding of a single text, in the same space as the index."""
+    return _embed_texts([text])[0]
 
 # ─── Helper Functions ─────────────────────────────────────────
+# Compiled once; clean_text runs on every chunk of every file during indexing
+_FIRST_HEADING_RE = re.compile(r'^\s*#\s+.+', re.MULTILINE)
+_IMAGE_RE = re.compile(r'!\[.*?\]\(.*?\)')
+# Each deletion can create matches for the next one (a login link leading a menu
+# line, a menu line between "Suche" and "..."), so these stay separate passes
+_LOGIN_RE = re.compile(r'\[(?:Anmelden|Login|Abmelden)\]\(.*?\)', re.IGNORECASE)
+_MENU_BULLET_RE = re.compile(r'^[ \t]*[\*\-•]\s*\[.*?\]\(.*?\).*$', re.MULTILINE)
+_BOILERPLATE_RE = re.compile(r'(Onlinehilfe|Tastenkombinationen|Feed\-Builder|Suche\s*\.{3})', re.IGNORECASE)
+_EMPTY_ANCHOR_RE = re.compile(r'^\s*\[\]\(.*?\)\s*$', re.MULTILINE)
+_MULTI_NEWLINE_RE = re.compile(r'\n{2,}')
+# A heading line: optional indent, #s, whitespace (never crossing a line break)
+_HEADING_SPLIT_RE = re.compile(r'^([^\S\n]*#+[^\S\n]+.*)$', re.MULTILINE)
+_OTHER_LINE_BREAK_RE = re.compile('[\r\x0b\x0c\x1c-\x1e\x85\u2028\u2029]')
+_SOURCE_RE = re.compile(r"<!--\s*source:\s*(.*?)\s*-->", re.IGNORECASE)
+
+# Confluence exports repeat the same boilerplate sections across pages; identical
+# raw chunks are cleaned once per build (build_index clears the cache when done,
+# and each index worker process has its own)
+@lru_cache(maxsize=65536)
 def clean_text(text: str) -> str:
     """
     Remove Confluence navigation, search bars, login links, images,
     and any leftover bullet list headers.
     """
     # Keep from the first real heading onward
-    m = re.search(r'^\s*#\s+.+', text, flags=re.MULTILINE)
+    m = _FIRST_HEADING_RE.search(text)
     if m:
         text = text[m.start():]
 
-    # Remove image links
-    text = re.sub(r'!\[.*?\]\(.*?\)', '', text)
+    # Remove image links (first, so an image can't hide a menu line's link)
+    text = _IMAGE_RE.sub('', text)
     # Remove login and utility links
-    text = re.sub(r'\[(?:Anmelden|Login|Abmelden)\]\(.*?\)', '', text, flags=re.IGNORECASE)
+    text = _LOGIN_RE.sub('', text)
     # Remove menu-like bullet links (allow leading spaces and different bullets)
-    text = re.sub(r'^[ \t]*[\*\-•]\s*\[.*?\]\(.*?\).*$','', text, flags=re.MULTILINE)
+    text = _MENU_BULLET_RE.sub('', text)
     # Remove common Confluence boilerplate tokens
-    text = re.sub(r'(Onlinehilfe|Tastenkombinationen|Feed\-Builder|Suche\s*\.{3})', '', text, flags=re.IGNORECASE)
+    text = _BOILERPLATE_RE.sub('', text)
     # Remove empty anchor lines: [](...)
-    text = re.sub(r'^\s*\[\]\(.*?\)\s*$', '', text, flags=re.MULTILINE)
+    text = _EMPTY_ANCHOR_RE.sub('', text)
     # Collapse multiple newlines
-    text = re.sub(r'\n{2,}', '\n\n', text)
+    text = _MULTI_NEWLINE_RE.sub('\n\n', text)
     return text.strip()
 
 def chunk_markdown(md_text: str):
     """Split markdown by headings (#, ##, ###...) into chunks with titles."""
-    lines = md_text.splitlines()
-    chunks = []
-    current_title = None
-    current_lines = []
-    for line in lines:
-        if re.match(r'^\s*#+\s+', line):
-            # flush previous
-            if current_lines and current_title:
-                chunks.append((current_title, clean_text("\n".join(current_lines).strip())))
-            current_title = line.strip()
-            current_lines = []
-        else:
-            current_lines.append(line)
-    if current_lines:
-        title = current_title or "# Inhalt"
-        chunks.append((title, clean_text("\n".join(current_lines).strip())))
+    # Same line boundaries as str.splitlines(), so the split below only sees "\n"
+    if _OTHER_LINE_BREAK_RE.search(md_text):
+        md_text = "\n".join(md_text.splitlines())
+    # One C-level split: [preface, title1, body1, title2, body2, ...]
+    parts = _HEADING_SPLIT_RE.split(md_text)
+    if len(parts) == 1:
+        chunks = [("# Inhalt", clean_text(md_text.strip()))]
+    else:
+        # Text before the first heading is navigation chrome and is dropped
+        chunks = [
+            (parts[i].strip(), clean_text(parts[i + 1].strip()))
+            for i in range(1, len(parts), 2)
+        ]
     # Drop empty chunks
     return [(t, c) for t, c in chunks if c]
 
 def _chunk_id(path: str, title: str, content: str) -> str:
-    h = hashlib.md5((path + "\n" + (title or "") + "\n" + (content or "")).encode("utf-8")).hexdigest()
-    return f"{Path(path).name}:{h}"
+    # Non-cryptographic: the ID only needs to change when the chunk does
+    h = xxhash.xxh3_128(path.encode("utf-8"))
+    h.update(b"\n")
+    h.update((title or "").encode("utf-8"))
+    h.update(b"\n")
+    h.update((content or "").encode("utf-8"))
+    return f"{Path(path).name}:{h.hexdigest()}"
 
 def _load_manifest() -> dict:
     if not MANIFEST_FILE.exists():
@@ -151,16 +293,8 @@ def _load_manifest() -> dict:
 
 def _save_manifest(manifest: dict):
     MANIFEST_FILE.parent.mkdir(parents=True, exist_ok=True)
-    MANIFEST_FILE.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
-
-def _collect_all_metadatas(collection) -> list:
-    try:
-        got = collection.get(include=["metadatas"])
-        mds = got.get("metadatas") or []
-        # Flatten single-level list
-        return mds
-    except Exception:
-        return []
+    # Compact: the manifest grows with every chunk ID and is machine-read only
+    MANIFEST_FILE.write_text(json.dumps(manifest, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
 
 def _sanitize_meta(d: dict) -> dict:
     """Ensure metadata values are of allowed types (str/bool/int/float) and not None."""
@@ -174,6 +308,37 @@ def _sanitize_meta(d: dict) -> dict:
             out[key] = str(val)
     return out
 
+def _process_file(path: str, prev_sha1: Optional[str] = None):
+    """
+    Read, clean and chunk one Markdown file (runs in worker processes for big builds).
+    Returns (sha1, ids, docs, metas); ids/docs/metas are None when the content
+    still hashes to `prev_sha1`. Returns None if the file cannot be read.
+    """
+    try:
+        raw = Path(path).read_bytes()
+    except Exception:
+        return None
+    # Unchanged content means unchanged chunks: skip chunking and the Chroma lookup
+    digest = hashlib.sha1(raw).hexdigest()
+    if digest == prev_sha1:
+        return digest, None, None, None
+    md_text = raw.decode("utf-8", errors="ignore")
+    m = _SOURCE_RE.search(md_text)
+    source_url = m.group(1).strip() if m else None
+    chunks = chunk_markdown(md_text)
+
+    # Build desired state for this file (IDs are content-hash + stable index to avoid duplicates)
+    new_ids = []
+    new_docs = []
+    new_metas = []
+    for idx, (title, content) in enumerate(chunks):
+        base = _chunk_id(path, title, content)
+        cid = f"{base}:{idx}"
+        new_ids.append(cid)
+        new_docs.append(f"{title}\n\n{content}")
+        new_metas.append(_sanitize_meta({"path": path, "url": source_url, "title": title, "content": content}))
+    return digest, new_ids, new_docs, new_metas
+
 def build_index():
     """
     Incremental build of ChromaDB collection from Markdown files.
@@ -181,41 +346,71 @@ def build_index():
     - Removes chunks for deleted files
     - Persists a manifest for fast detection
     """
+    global _INDEX_READY
     print("🔍 Incremental indexing with ChromaDB…")
 
-    client = _chroma_client()
-    collection = client.get_or_create_collection(COLLECTION_NAME)
+    collection = _get_collection()
 
     manifest = _load_manifest()
     known_files = set(manifest.get("files", {}).keys())
-    current_files = sorted([str(p) for p in DOCS_DIR.glob("*.md") if "_src_" not in p.name])
+    same_pipeline = manifest.get("pipeline_version") == PIPELINE_VERSION
+    if not same_pipeline and known_files:
+        print("♻️ Chunking pipeline changed; re-chunking all files (only changed chunks are re-embedded).")
+    # One directory scan; mtimes come from the same dirents (no stat per file on Windows)
+    mtimes = {}
+    try:
+        with os.scandir(DOCS_DIR) as it:
+            for e in it:
+                if e.name.endswith(".md") and "_src_" not in e.name and e.is_file():
+                    mtimes[str(DOCS_DIR / e.name)] = e.stat().st_mtime
+    except FileNotFoundError:
+        pass
+    current_files = sorted(mtimes)
     current_set = set(current_files)
 
     # Handle modifications and additions
+    skipped = 0
+    # Writes are collected across files and applied in a few large batches;
+    # each Chroma call is its own SQLite transaction + HNSW update
+    delete_ids = []
+    add_ids, add_docs, add_metas = [], [], []
+    candidates = []
     for path in current_files:
-        p = Path(path)
-        try:
-            md_text = p.read_text(encoding="utf-8", errors="ignore")
-        except Exception:
+        entry = manifest.get("files", {}).get(path)
+        # Same mtime as last build: don't even open the file
+        if same_pipeline and entry and entry.get("mtime") == mtimes[path] and entry.get("sha1") and entry.get("ids"):
+            skipped += 1
             continue
-        m = re.search(r"<!--\s*source:\s*(.*?)\s*-->", md_text, flags=re.IGNORECASE)
-        source_url = m.group(1).strip() if m else None
-        chunks = chunk_markdown(md_text)
-
-        # Build desired state for this file (IDs are content-hash + stable index to avoid duplicates)
-        new_ids = []
-        new_docs = []
-        new_metas = []
-        for idx, (title, content) in enumerate(chunks):
-            base = _chunk_id(path, title, content)
-            cid = f"{base}:{idx}"
-            new_ids.append(cid)
-            new_docs.append(f"{title}\n\n{content}")
-            new_metas.append(_sanitize_meta({"path": path, "url": source_url, "title": title, "content": content}))
-
-        # Fetch existing chunk ids for this file
+        prev_sha1 = entry.get("sha1") if same_pipeline and entry and entry.get("ids") else None
+        candidates.append((path, prev_sha1))
+
+    # Read/clean/chunk/hash is pure CPU per file: spread large batches over processes
+    if len(candidates) >= PARALLEL_MIN_FILES:
+        # spawn, not the Linux default fork: build_index also runs inside the UI
+        # process, whose server/HTTP/torch threads may hold locks at fork time
+        with ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn")) as ex:
+            processed = list(ex.map(_process_file, *zip(*candidates), chunksize=8))
+    elif len(candidates) > 1:
+        # Too few for processes, but threads still overlap the file reads
+        with ThreadPoolExecutor(max_workers=min(8, len(candidates))) as ex:
+            processed = list(ex.map(_process_file, *zip(*candidates)))
+    else:
+        processed = [_process_file(path, prev) for path, prev in candidates]
+
+    for (path, _), result in zip(candidates, processed):
+        if result is None:
+            continue
+        digest, new_ids, new_docs, new_metas = result
+        if new_ids is None:
+            # Touched but identical (e.g. re-crawled): remember the new mtime
+            manifest["files"][path]["mtime"] = mtimes[path]
+            skipped += 1
+            continue
+
+        # Fetch existing chunk ids for this file from Chroma itself, not the manifest,
+        # so chunks stored under an older ID scheme are found and deleted too
         try:
-            existing = collection.get(where={"path": path}, include=["metadatas", "documents"])
+            existing = collection.get(where={"path": path}, include=[])
             existing_ids = set(existing.get("ids") or [])
         except Exception:
             existing_ids = set()
@@ -225,113 +420,169 @@ def build_index():
         to_add_mask = [cid not in existing_ids for cid in new_ids]
 
         # Delete removed chunks
-        if to_delete:
-            try:
-                collection.delete(ids=to_delete)
-            except Exception:
-                pass
-
-        # Add new/changed chunks
-        if any(to_add_mask):
-            add_ids = [cid for cid, m in zip(new_ids, to_add_mask) if m]
-            add_docs = [doc for doc, m in zip(new_docs, to_add_mask) if m]
-            add_metas = [mt for mt, m in zip(new_metas, to_add_mask) if m]
-            # Deduplicate within batch to avoid any accidental duplicates
-            unique = {}
-            for cid, doc, meta in zip(add_ids, add_docs, add_metas):
-                unique[cid] = (doc, meta)
-            add_ids = list(unique.keys())
-            add_docs = [unique[cid][0] for cid in add_ids]
-            add_metas = [unique[cid][1] for cid in add_ids]
-            # Defensive: delete any of these IDs if they already exist to avoid DuplicateIDError
-            try:
-                if add_ids:
-                    collection.delete(ids=add_ids)
-            except Exception:
-                pass
-            # Embed only the new docs (via Ollama or ST)
-            embeddings = _embed_texts(add_docs)
-            collection.add(ids=add_ids, documents=add_docs, metadatas=add_metas, embeddings=embeddings.tolist())
+        delete_ids.extend(to_delete)
+
+        # Add new/changed chunks (IDs end in the chunk index, so they are unique per file)
+        for cid, doc, meta, m in zip(new_ids, new_docs, new_metas, to_add_mask):
+            if m:
+                add_ids.append(cid)
+                add_docs.append(doc)
+                add_metas.append(meta)
 
         # Update manifest for this file
         manifest.setdefault("files", {})[path] = {
-            "mtime": p.stat().st_mtime,
+            "mtime": mtimes[path],
+            "sha1": digest,
             "ids": new_ids,
         }
+    if skipped:
+        print(f"⏭️ {skipped} unchanged files skipped.")
 
-    # Handle deletions for files removed from docs directory
-    removed_files = known_files - current_set
-    for path in removed_files:
+    for i in range(0, len(delete_ids), CHROMA_BATCH):
         try:
-            collection.delete(where={"path": path})
+            collection.delete(ids=delete_ids[i:i + CHROMA_BATCH])
         except Exception:
             pass
+
+    # Embed only the new docs (via Ollama or ST), in one call across all files
+    # so the encoder sees full batches instead of a few chunks per file
+    if add_ids:
+        print(f"🧮 Embedding {len(add_docs)} new chunks…")
+        # Chroma takes the float32 matrix as is; no list-of-floats conversion
+        embeddings = np.ascontiguousarray(_embed_texts(add_docs), dtype="float32")
+        for i in range(0, len(add_ids), CHROMA_BATCH):
+            j = i + CHROMA_BATCH
+            # upsert overwrites an ID that already exists instead of raising,
+            # so no defensive delete is needed first
+            collection.upsert(
+                ids=add_ids[i:j], documents=add_docs[i:j], metadatas=add_metas[i:j],
+                embeddings=embeddings[i:j],
+            )
+
+    # Handle deletions for files removed from docs directory
+    removed_files = sorted(known_files - current_set)
+    for i in range(0, len(removed_files), CHROMA_BATCH):
+        batch = removed_files[i:i + CHROMA_BATCH]
+        try:
+            collection.delete(where={"path": {"$in": batch}})
+        except Exception:
+            # Older Chroma without $in: one call per file
+            for path in batch:
+                try:
+                    collection.delete(where={"path": path})
+                except Exception:
+                    pass
+    for path in removed_files:
         manifest["files"].pop(path, None)
 
-    # Save META_FILE from collection snapshot
-    all_meta = _collect_all_metadatas(collection)
+    # META_FILE is only a build marker now; all metadata lives in Chroma
     with open(META_FILE, "wb") as f:
-        pickle.dump(all_meta, f)
+        pickle.dump({"schema_version": META_SCHEMA_VERSION}, f)
 
     # Write manifest and index marker
+    manifest["pipeline_version"] = PIPELINE_VERSION
     _save_manifest(manifest)
     INDEX_FILE.parent.mkdir(parents=True, exist_ok=True)
     if not INDEX_FILE.exists():
         INDEX_FILE.write_text("ok", encoding="utf-8")
 
+    # Don't keep up to 65k raw/cleaned chunk pairs alive in the long-running UI process
+    clean_text.cache_clear()
+
+    _INDEX_READY = True
+
     total_chunks = sum(len(entry.get("ids", [])) for entry in manifest.get("files", {}).values())
     print(f"✅ Incremental index complete: {total_chunks} chunks across {len(manifest.get('files', {}))} files.")
 
+@lru_cache(maxsize=1)
+def _get_collection():
+    """Open the Chroma collection once per process; the handle stays valid across rebuilds."""
+    collection = _chroma_client().get_or_create_collection(COLLECTION_NAME)
+    if CHROMA_SEARCH_EF:
+        _set_search_ef(collection, CHROMA_SEARCH_EF)
+    return collection
+
+def _set_search_ef(collection, ef: int):
+    # Chroma >= 1.0 reads ef_search from the collection configuration only;
+    # "hnsw:search_ef" metadata is still accepted there but has no effect
+    config = getattr(collection, "configuration", None)
+    try:
+        if isinstance(config, dict):
+            if (config.get("hnsw") or {}).get("ef_search") == ef:
+                return
+            collection.modify(configuration={"hnsw": {"ef_search": ef}})
+            return
+    except TypeError:
+        pass  # modify() without a configuration argument: older Chroma
+    except Exception as e:
+        print(f"⚠️ Could not set CHROMA_SEARCH_EF: {e}")
+        return
+    # Older Chroma: HNSW settings live in the collection metadata
+    metadata = dict(collection.metadata or {})
+    if metadata.get("hnsw:search_ef") != ef:
+        metadata["hnsw:search_ef"] = ef
+        try:
+            collection.modify(metadata=metadata)
+        except Exception as e:
+            print(f"⚠️ Could not set CHROMA_SEARCH_EF: {e}")
+
+# Set once the index is known to exist, so retrieval stops checking the marker files
+_INDEX_READY = False
+
+def index_ready() -> bool:
+    """True once the index exists; stats the marker files only until then."""
+    global _INDEX_READY
+    if not _INDEX_READY and META_FILE.exists() and INDEX_FILE.exists():
+        _INDEX_READY = True
+    return _INDEX_READY
+
 def load_data():
     """
-    Ensure Chroma collection and metadata are available. Rebuild if missing/corrupted.
-    Returns the Chroma collection and metadata list.
+    Ensure the Chroma collection is available, building it if missing.
+    Returns (None, collection); read metadata from the collection itself.
     """
-    if not META_FILE.exists() or not INDEX_FILE.exists():
+    if not index_ready():
         build_index()
+    return None, _get_collection()
 
-    try:
-        with open(META_FILE, "rb") as f:
-            meta = pickle.load(f)
-    except Exception:
-        print("⚠️ meta.pkl missing or corrupted. Rebuilding index...")
-        build_index()
-        with open(META_FILE, "rb") as f:
-            meta = pickle.load(f)
-
-    client = _chroma_client()
-    collection = client.get_or_create_collection(COLLECTION_NAME)
-    return meta, collection
-
-def retrieve(query: str, top_k: int = 3):
+def retrieve(query: str, top_k: int = 3, query_vec=None):
     """
     Retrieve top_k most relevant chunks via Chroma collection.
-    Returns a list of dicts with keys: path, url, title, content.
+    Pass `query_vec` (from `embed`) to reuse an already computed query embedding.
+    Returns a list of dicts with keys: path, url, title, content (always str).
     """
-    meta, collection = load_data()
+    # Metadata comes back from Chroma with the query results
+    if not index_ready():
+        build_index()
+    collection = _get_collection()
     # Encode query consistent with index embeddings
-    query_vec = _embed_query(query)
+    if query_vec is None:
+        query_vec = _embed_query(query)
+    else:
+        query_vec = np.asarray(query_vec, dtype="float32").reshape(1, -1)
 
     res = collection.query(query_embeddings=query_vec, n_results=top_k)
     metadatas = res.get("metadatas") or []
     if not metadatas:
         return []
     items = metadatas[0]
-    # Ensure structure compatibility
-    results = []
-    for it in items:
-        results.append({
-            "path": it.get("path"),
-            "url": it.get("url"),
-            "title": it.get("title"),
-            "content": it.get("content"),
-        })
-    return results
+    # Ensure structure compatibility: every key present and a str, so callers can index directly
+    return [
+        {
+            "path": it.get("path") or "",
+            "url": it.get("url") or "",
+            "title": it.get("title") or "",
+            "content": it.get("content") or "",
+        }
+        for it in items
+    ]
 
 # ─── Main ──────────────────────────────────────────────────────
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    configure_cpu_threads()
     # If old index exists but is unclean, delete to rebuild
-    if not META_FILE.exists() or not INDEX_FILE.exists():
+    if not index_ready():
         build_index()
 
     query = input("❓ Ask something about Oxaion Docs: ").strip()
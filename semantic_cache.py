@@ -0,0 +1,206 @@
+import os
+import json
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Hashable, Optional, Tuple
+
+import numpy as np
+
+# ─── Settings ──────────────────────────────────────────────────
+# Cosine similarity above which a cached answer is reused
+DEFAULT_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+DEFAULT_MAX_SIZE = int(os.environ.get("SEMANTIC_CACHE_MAX", "1024"))
+DEFAULT_TTL = float(os.environ.get("SEMANTIC_CACHE_TTL", "86400"))  # seconds
+# On-disk copy so cached answers survive restarts
+CACHE_DB = Path("data/semantic_cache.db")
+
+
+class SemanticCache:
+    """
+    Answer cache matched by question embedding instead of exact text.
+    Entries live in per-settings buckets (e.g. lang, model, k, use_ollama), each
+    holding a [N, D] matrix of unit-normalized question embeddings, so a lookup
+    is a single matrix-vector product. Buckets are kept in LRU order; entries
+    expire after `ttl` seconds and the oldest are evicted beyond `max_size`.
+    With `db_path`, entries are also written to SQLite (by a background writer
+    thread, so callers never wait on a commit) and reloaded on start.
+    Bucket keys must then be JSON-serializable tuples.
+    """
+
+    def __init__(
+        self,
+        threshold: float = DEFAULT_THRESHOLD,
+        max_size: int = DEFAULT_MAX_SIZE,
+        ttl: float = DEFAULT_TTL,
+        db_path: Optional[Path] = None,
+    ):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        # key -> {"emb": np.ndarray [N, D], "rows": [(answer, sources_md, ts), ...]}
+        self._buckets: "OrderedDict[Hashable, dict]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._db = None
+        # Pending SQLite writes, applied in order by the writer thread
+        self._writes: "queue.Queue[tuple]" = queue.Queue()
+        if db_path is not None:
+            self._open_db(Path(db_path))
+
+    def lookup(self, key: Hashable, q: np.ndarray) -> Optional[Tuple[str, str]]:
+        """Return (answer, sources_md) of the most similar cached question, or None."""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                return None
+            self._expire(key, bucket)
+            rows = bucket["rows"]
+            # Embedding backend may have changed (Ollama vs SentenceTransformers)
+            if not rows or bucket["emb"].shape[1] != q.shape[0]:
+                return None
+            sims = bucket["emb"] @ q
+            best = int(sims.argmax())
+            if sims[best] < self.threshold:
+                return None
+            self._buckets.move_to_end(key)
+            answer, sources_md, _ = rows[best]
+            return answer, sources_md
+
+    def store(self, key: Hashable, q: np.ndarray, answer: str, sources_md: str = "", question: str = ""):
+        row = np.asarray(q, dtype="float32").reshape(1, -1)
+        ts = time.time()
+        with self._lock:
+            self._add(key, row, answer, sources_md, ts)
+            self._evict()
+            # Queued under the lock, so disk writes happen in the same order as
+            # the in-memory changes (an invalidate() can't overtake this insert)
+            self._write("insert", key, question, row, answer, sources_md, ts)
+
+    def invalidate(self):
+        """Drop everything, e.g. after the document index was rebuilt."""
+        with self._lock:
+            self._buckets.clear()
+            self._size = 0
+            self._write("clear")
+
+    def _add(self, key: Hashable, row: np.ndarray, answer: str, sources_md: str, ts: float):
+        bucket = self._buckets.get(key)
+        if bucket is None or bucket["emb"].shape[1] != row.shape[1]:
+            if bucket is not None:
+                self._size -= len(bucket["rows"])
+            bucket = {"emb": row, "rows": []}
+            self._buckets[key] = bucket
+        else:
+            bucket["emb"] = np.vstack([bucket["emb"], row])
+        bucket["rows"].append((answer, sources_md, ts))
+        self._size += 1
+        self._buckets.move_to_end(key)
+
+    # ─── Persistence ───────────────────────────────────────────
+    def _open_db(self, path: Path):
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Opened here, then only used by the writer thread
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, bucket TEXT, question TEXT, "
+                "emb BLOB, answer TEXT, sources_md TEXT, ts REAL)"
+            )
+            self._db.execute("DELETE FROM entries WHERE ts < ?", (time.time() - self.ttl,))
+            self._db.commit()
+            rows = self._db.execute(
+                "SELECT bucket, emb, answer, sources_md, ts FROM entries ORDER BY id DESC LIMIT ?",
+                (self.max_size,),
+            ).fetchall()
+        except Exception as e:
+            print(f"⚠️ Semantic cache persistence disabled: {e}")
+            self._db = None
+            return
+        # Oldest first so bucket order and FIFO eviction match the original inserts
+        for bucket, emb, answer, sources_md, ts in reversed(rows):
+            key = tuple(json.loads(bucket))
+            self._add(key, np.frombuffer(emb, dtype="float32").reshape(1, -1), answer, sources_md, ts)
+        threading.Thread(target=self._write_loop, name="semantic-cache-writer", daemon=True).start()
+
+    def _write(self, op: str, *args):
+        if self._db is not None:
+            self._writes.put((op, args))
+
+    def _write_loop(self):
+        while True:
+            op, args = self._writes.get()
+            if op == "insert":
+                self._db_insert(*args)
+            elif op == "clear":
+                self._db_exec("DELETE FROM entries")
+
+    def _db_insert(self, key: Hashable, question: str, row: np.ndarray, answer: str, sources_md: str, ts: float):
+        if self._db is None:
+            return
+        try:
+            self._db.execute(
+                "INSERT INTO entries (bucket, question, emb, answer, sources_md, ts) VALUES (?, ?, ?, ?, ?, ?)",
+                (json.dumps(list(key)), question, row.tobytes(), answer, sources_md, ts),
+            )
+            # Keep the table bounded like the in-memory cache
+            self._db.execute(
+                "DELETE FROM entries WHERE ts < ? OR id NOT IN (SELECT id FROM entries ORDER BY id DESC LIMIT ?)",
+                (ts - self.ttl, self.max_size),
+            )
+            self._db.commit()
+        except Exception:
+            pass
+
+    def _db_exec(self, sql: str):
+        if self._db is None:
+            return
+        try:
+            self._db.execute(sql)
+            self._db.commit()
+        except Exception:
+            pass
+
+    def _expire(self, key: Hashable, bucket: dict):
+        # Rows are appended in time order, so expired ones form a prefix
+        cutoff = time.time() - self.ttl
+        rows = bucket["rows"]
+        n = 0
+        while n < len(rows) and rows[n][2] < cutoff:
+            n += 1
+        if n:
+            self._drop_oldest(key, bucket, n)
+
+    def _evict(self):
+        # Trim the least recently used bucket first, oldest entries within it
+        while self._size > self.max_size and self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            self._drop_oldest(key, bucket, min(len(bucket["rows"]), self._size - self.max_size))
+
+    def _drop_oldest(self, key: Hashable, bucket: dict, n: int):
+        del bucket["rows"][:n]
+        bucket["emb"] = bucket["emb"][n:]
+        self._size -= n
+        if not bucket["rows"]:
+            del self._buckets[key]
+
+
+_CACHE: Optional[SemanticCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_cache() -> SemanticCache:
+    """Process-wide instance shared by the UI handlers, opened on first use.
+
+    Not created at import: that would create data/ and write to SQLite in every
+    process importing this module (tools, index worker processes).
+    """
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = SemanticCache(db_path=CACHE_DB)
+        return _CACHE
@@ -2,6 +2,7 @@
 import argparse
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from urllib.parse import urlparse
 
@@ -11,7 +12,32 @@ DOCS_DIR = ROOT / "data" / "docs"
 # Matches Markdown links but not images. Captures display text and URL.
 LINK_RE = re.compile(r'''(?<!\!)\[(?P<text>[^\]]+)\]\((?P<url>[^)\s]+)(?:\s+"[^"]*")?\)''')
 
-FENCE_RE = re.compile(r"^```.*$")  # detect fenced code blocks
+FENCE_RE = re.compile(r"^```.*$", re.M)  # detect fenced code blocks
+# Line boundaries str.splitlines() knows besides "\n"
+OTHER_LINE_BREAK_RE = re.compile(r"[\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]")
+EMPTY_ITEM_RE = re.compile(r"^\s*([*+-])\s*$")  # list item left empty by a removal
+MULTI_SPACE_RE = re.compile(r"\s{2,}")
+BLANK_RUN_RE = re.compile(r"\n{3,}")
+
+
+def _repl(m: re.Match) -> str:
+    text = m.group('text').strip()
+    url = m.group('url').strip()
+    # Decide based on URL
+    p = urlparse(url)
+    # External http(s)
+    if p.scheme in ("http", "https"):
+        host = p.netloc
+        if host:
+            return f"{text} — {host}"
+        else:
+            # Unlikely, but fallback to text only
+            return text
+    # Local/relative
+    if url.lower().endswith('.md') or (not p.scheme and not p.netloc and url.lower().endswith('.md')):
+        return ""  # remove entirely
+    # Other relative resources (e.g., anchors, pdf). Keep just text.
+    return text
 
 
 def transform_line(line: str) -> str:
@@ -19,33 +45,15 @@ def transform_line(line: str) -> str:
     Transform a single line by converting external links to "Text — host"
     and removing links pointing to local .md files entirely. Skips image links.
     """
-    def _repl(m: re.Match) -> str:
-        text = m.group('text').strip()
-        url = m.group('url').strip()
-        # Decide based on URL
-        p = urlparse(url)
-        # External http(s)
-        if p.scheme in ("http", "https"):
-            host = p.netloc
-            if host:
-                return f"{text} — {host}"
-            else:
-                # Unlikely, but fallback to text only
-                return text
-        # Local/relative
-        if url.lower().endswith('.md') or (not p.scheme and not p.netloc and url.lower().endswith('.md')):
-            return ""  # remove entirely
-        # Other relative resources (e.g., anchors, pdf). Keep just text.
-        return text
-
-    new_line = LINK_RE.sub(_repl, line)
+    # Every link contains "](": a substring test is far cheaper than running the regex
+    new_line = LINK_RE.sub(_repl, line) if "](" in line else line
 
     # Remove empty list items like "- " or "* " caused by full removal
-    if re.match(r"^\s*([*+-])\s*$", new_line):
+    if EMPTY_ITEM_RE.match(new_line):
         return ""  # drop the line entirely
 
     # Normalize double spaces created by removals
-    new_line = re.sub(r"\s{2,}", " ", new_line).rstrip()
+    new_line = MULTI_SPACE_RE.sub(" ", new_line).rstrip()
     return new_line
 
 
@@ -54,24 +62,37 @@ def transform_content(md: str) -> str:
     Transform full Markdown content while preserving fenced code blocks.
     We only process non-code sections.
     """
-    lines = md.splitlines()
+    # Same lines as md.splitlines(), but separated by "\n" only
+    if OTHER_LINE_BREAK_RE.search(md):
+        md = "\n".join(md.splitlines())
+    elif md.endswith("\n"):
+        md = md[:-1]
     out_lines = []
     in_fence = False
-    for line in lines:
-        if FENCE_RE.match(line):
-            in_fence = not in_fence
-            out_lines.append(line.rstrip())
-            continue
-        if in_fence:
-            out_lines.append(line.rstrip())
-        else:
-            out_lines.append(transform_line(line))
+    pos = 0
+    # Fence lines are located by the regex engine; only the text between them is split
+    for m in FENCE_RE.finditer(md):
+        if m.start() > pos:
+            _transform_segment(md[pos:m.start() - 1], in_fence, out_lines)
+        out_lines.append(m.group().rstrip())
+        in_fence = not in_fence
+        pos = m.end() + 1
+    if pos <= len(md):
+        _transform_segment(md[pos:], in_fence, out_lines)
     # Remove stray empty lines created by deletions (collapse 3+ empties to 1)
     text = "\n".join(out_lines)
-    text = re.sub(r"\n{3,}", "\n\n", text)
+    text = BLANK_RUN_RE.sub("\n\n", text)
     return text
 
 
+def _transform_segment(segment: str, in_fence: bool, out_lines: list):
+    lines = segment.split("\n")
+    if in_fence:
+        out_lines.extend(line.rstrip() for line in lines)
+    else:
+        out_lines.extend(transform_line(line) for line in lines)
+
+
 def process_file(path: Path, write: bool, backup: bool) -> bool:
     orig = path.read_text(encoding='utf-8')
     new = transform_content(orig)
@@ -98,9 +119,13 @@ def main():
     if args.limit:
         md_files = md_files[: args.limit]
 
+    # Files are independent: overlap their reads/writes, report in the original order
+    backup = not args.no_backup
+    with ThreadPoolExecutor(max_workers=min(32, len(md_files) or 1)) as ex:
+        results = list(ex.map(lambda p: process_file(p, write=args.write, backup=backup), md_files))
+
     changed = 0
-    for p in md_files:
-        did_change = process_file(p, write=args.write, backup=not args.no_backup)
+    for p, did_change in zip(md_files, results):
         status = "CHANGED" if did_change else "ok"
         if did_change or not args.write:
             print(f"[{status}] {p.relative_to(ROOT)}")